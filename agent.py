@@ -1,92 +1,351 @@
 # agent.py
 
+import asyncio
+import collections
+import functools
+import hashlib
+import os
+import weakref
 import langchain_core.prompts
 import langchain_core.runnables.history
-import langchain_google_genai
-import langchain_community.chat_models
 import langchain_core.messages
+from langchain_core.chat_history import BaseChatMessageHistory
 import config
 
+# Provider SDKs are imported once at module load instead of inside every call;
+# only the stack for the active environment actually needs to be installed.
+try:
+    import ollama
+    import httpx  # the ollama SDK rides on httpx, so this import is free
+    from langchain_community.chat_models import ChatOllama
+except ImportError:  # development (Ollama) stack not installed
+    ollama = None
+    httpx = None
+    ChatOllama = None
+try:
+    import h2  # noqa: F401 — presence enables HTTP/2 in the httpx clients
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+try:
+    import diskcache
+except ImportError:  # only needed for the persistent response cache
+    diskcache = None
+try:
+    import google.generativeai as genai
+    from langchain_google_genai import ChatGoogleGenerativeAI
+except ImportError:  # production (Gemini) stack not installed
+    genai = None
+    ChatGoogleGenerativeAI = None
+
+try:
+    from prompt_toolkit import PromptSession
+except ImportError:  # REPL falls back to plain input() in a worker thread
+    PromptSession = None
+
+from langchain_community.chat_message_histories import ChatMessageHistory
+try:
+    import sqlalchemy
+    from langchain_community.chat_message_histories import SQLChatMessageHistory
+except ImportError:  # requires SQLAlchemy, only needed for DB-backed history
+    sqlalchemy = None
+    SQLChatMessageHistory = None
+
 logger = config.logger
 
-class AIAgent:
+# Sentinel returned (not raised) by the generation methods on failure; callers
+# that cache or persist responses should check for it before storing.
+GENERATION_ERROR = "Sorry, there was an error generating a response."
 
-    def generate_text(self, user_prompt: str) -> str:
-        """Generate text using Gemini (production) or Ollama (development) based on environment."""
-        logger.debug(f"generate_text called with prompt: {user_prompt[:100]}{'...' if len(user_prompt) > 100 else ''}")
-        try:
-            if self.production_env:
-                logger.info("Using Gemini LLM for text generation.")
-                response = self.llm.generate_content(user_prompt)
-                logger.debug(f"Gemini response: {getattr(response, 'text', str(response))[:100]}")
-                return response.text
-            else:
-                logger.info("Using Ollama LLM for text generation.")
-                response = self.llm.chat(
-                    model=self.current_model,
-                    messages=[{'role': 'user', 'content': user_prompt}]
+# Cached client factories: every AIAgent constructed for the same host/model
+# shares one SDK client (and its underlying HTTP connection pool) instead of
+# opening fresh connections per instance.
+def _ollama_http_kwargs():
+    """Connection settings forwarded to the httpx client underneath the ollama
+    SDK: a keep-alive pool sized for the batch path, and HTTP/2 multiplexing
+    when h2 is installed (it only engages on TLS endpoints)."""
+    if httpx is None:
+        return {}
+    return {
+        "timeout": 60.0,
+        "limits": httpx.Limits(max_keepalive_connections=16, max_connections=32),
+        "http2": _HTTP2_AVAILABLE,
+    }
+
+@functools.lru_cache(maxsize=None)
+def _ollama_client(host: str):
+    return ollama.Client(host=host, **_ollama_http_kwargs())
+
+@functools.lru_cache(maxsize=None)
+def _gemini_model(model_name: str):
+    # genai.configure() is process-global, so the model handle is safely shared.
+    return genai.GenerativeModel(model_name)
+
+@functools.lru_cache(maxsize=None)
+def _history_engine(db_path: str):
+    """Shared SQLite engine for chat history, tuned for write throughput (WAL)."""
+    engine = sqlalchemy.create_engine(
+        f"sqlite:///{db_path}",
+        connect_args={"check_same_thread": False}
+    )
+
+    @sqlalchemy.event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_conn, _connection_record):
+        dbapi_conn.executescript(
+            "PRAGMA journal_mode=WAL;"
+            "PRAGMA synchronous=NORMAL;"
+            "PRAGMA cache_size=-64000;"
+            "PRAGMA temp_store=MEMORY;"
+        )
+
+    return engine
+
+if SQLChatMessageHistory is not None:
+    class _BatchedSQLChatMessageHistory(SQLChatMessageHistory):
+        """SQL history that writes each batch of messages in one transaction
+        instead of one INSERT + commit per message."""
+
+        def add_messages(self, messages):
+            with self.session_maker() as session:
+                session.add_all(
+                    [self.converter.to_sql_model(m, self.session_id) for m in messages]
                 )
-                logger.debug(f"Ollama response: {str(response)[:100]}")
-                return response['message']['content']
-        except Exception as e:
-            logger.error(f"Error generating text: {e}")
-            return "Sorry, there was an error generating a response."
+                session.commit()
+else:
+    _BatchedSQLChatMessageHistory = None
+
+class _WindowedChatHistory(BaseChatMessageHistory):
+    """History view that bounds what gets replayed to the LLM.
+
+    The underlying history still stores everything; `messages` returns a
+    running summary of older turns plus the last `window` raw messages, so
+    per-turn prompt size stays constant instead of growing with conversation
+    length.
+    """
+
+    def __init__(self, inner, agent, window: int):
+        self._inner = inner
+        self._agent = agent
+        self._window = window
+        self._summary = ""
+        self._summarized_count = 0
+
+    @property
+    def messages(self):
+        raw = self._inner.messages
+        if len(raw) <= self._window:
+            return raw
+        self._maybe_summarize(raw)
+        trimmed = []
+        if self._summary:
+            # Injected as a human turn: Gemini only accepts a system message
+            # in the leading position, and this lands mid-prompt after the
+            # template's system message.
+            trimmed.append(langchain_core.messages.HumanMessage(
+                content=f"Context: summary of the earlier conversation: {self._summary}"
+            ))
+        return trimmed + raw[-self._window:]
+
+    def _maybe_summarize(self, raw):
+        """Refresh the running summary once a window's worth of new turns has
+        accumulated beyond what the current summary covers."""
+        cutoff = len(raw) - self._window
+        if cutoff - self._summarized_count < self._window:
+            return
+        transcript = '\n'.join(f"{m.type}: {m.content}" for m in raw[:cutoff])
+        summary = self._agent.generate_text(
+            "Summarize this conversation so far, keeping key facts and decisions:\n"
+            + transcript
+        )
+        # generate_text signals failure with a sentinel, not an exception; keep
+        # the previous summary and count so summarization retries next read.
+        if summary == GENERATION_ERROR:
+            logger.warning("History summarization failed; keeping previous summary.")
+            return
+        self._summary = summary
+        self._summarized_count = cutoff
+
+    def add_message(self, message):
+        self._inner.add_message(message)
+
+    def add_messages(self, messages):
+        self._inner.add_messages(messages)
+
+    def clear(self):
+        self._inner.clear()
+        self._summary = ""
+        self._summarized_count = 0
+
+class AIAgent:
+
     def __init__(self):
         logger.info("Initializing AIAgent...")
+        # Exact-match response cache keyed on (model, prompt); repeated prompts
+        # skip the LLM round-trip entirely. With RESPONSE_CACHE_DIR set (and
+        # diskcache installed) hits also survive restarts and other processes.
+        cache_dir = getattr(config.config, "RESPONSE_CACHE_DIR", "")
+        if cache_dir and diskcache is not None:
+            self._response_cache = diskcache.Cache(cache_dir)
+        else:
+            self._response_cache = {}
+        # One history object per session_id, reused across invocations. Weak
+        # values let abandoned sessions be garbage collected; the deque keeps
+        # recently used histories alive between turns (nothing else holds a
+        # reference to an in-memory history once invoke() returns).
+        self._session_histories = weakref.WeakValueDictionary()
+        self._recent_histories = collections.deque(maxlen=32)
+        # One AsyncClient per event loop (see _get_async_llm); entries drop
+        # away when their loop is garbage collected.
+        self._loop_async_clients = weakref.WeakKeyDictionary()
         self._initialize_llm()
+        if config.config.LLM_PROVIDER == "ollama":
+            # Local history directory; created once here instead of on every lookup.
+            os.makedirs(os.path.dirname(config.config.MEMORY_DB_PATH), exist_ok=True)
         self.prompt = self._initialize_prompt()
         self.chain = self.prompt | self.langchain_llm
         self.with_message_history = self._initialize_message_history()
 
     def _initialize_llm(self):
         """Initializes both LangChain and direct API LLMs for Gemini or Ollama based on environment."""
-        import os
         self.production_env = os.getenv("ENVIRONMENT", "development").lower() == "production"
-        logger.debug(f"Production environment: {self.production_env}")
+        logger.debug("Production environment: %s", self.production_env)
         if self.production_env:
             logger.info("Setting up Gemini LLM...")
-            import google.generativeai as genai
             api_key = os.getenv("GOOGLE_API_KEY")
             if not api_key:
                 logger.error("GEMINI_API_KEY not set for production environment.")
                 raise ValueError("GEMINI_API_KEY not set for production environment.")
             genai.configure(api_key=api_key)
             self.current_model = os.getenv("GEMINI_MODEL", "gemini-pro")
-            self.llm = genai.GenerativeModel(self.current_model)
-            import langchain_google_genai
-            self.langchain_llm = langchain_google_genai.ChatGoogleGenerativeAI(
+            self.llm = _gemini_model(self.current_model)
+            self.langchain_llm = ChatGoogleGenerativeAI(
                 model=self.current_model,
                 google_api_key=api_key
             )
         else:
             logger.info("Setting up Ollama LLM...")
-            import ollama
             ollama_host = os.getenv("OLLAMA_BASE_URL", "http://192.168.1.100:11434")
+            # Per-request tuning (num_ctx, num_predict, ...) passed to every chat call.
+            self.ollama_options = getattr(config.config, "OLLAMA_OPTIONS", None) or None
             self.current_model = os.getenv("OLLAMA_MODEL", "gemma3")
-            self.llm = ollama.Client(host=ollama_host)
-            import langchain_community.chat_models
-            self.langchain_llm = langchain_community.chat_models.ChatOllama(
+            self.llm = _ollama_client(ollama_host)
+            # Async clients for generate_text_batch are created per event loop
+            # in _get_async_llm; set OLLAMA_NUM_PARALLEL /
+            # OLLAMA_MAX_LOADED_MODELS on the Ollama server to allow the
+            # concurrent requests to actually decode in parallel.
+            self.ollama_host = ollama_host
+            self.langchain_llm = ChatOllama(
                 model=self.current_model,
                 base_url=ollama_host
             )
 
+    def _cache_key(self, user_prompt: str) -> bytes:
+        """Cache key for a prompt: blake2b over model + prompt (faster than MD5)."""
+        return hashlib.blake2b(
+            f"{self.current_model}|{user_prompt}".encode(), digest_size=16
+        ).digest()
+
     def generate_text(self, user_prompt: str) -> str:
         """Generate text using Gemini (production) or Ollama (development) based on environment."""
+        logger.debug("generate_text called with prompt: %.100s", user_prompt)
+        key = self._cache_key(user_prompt)
+        cached = self._response_cache.get(key)
+        if cached is not None:
+            logger.debug("Response cache hit; skipping LLM call.")
+            return cached
         try:
             if self.production_env:
                 # Gemini
                 response = self.llm.generate_content(user_prompt)
-                return response.text
+                result = response.text
             else:
                 # Ollama
                 response = self.llm.chat(
                     model=self.current_model,
-                    messages=[{'role': 'user', 'content': user_prompt}]
+                    messages=[{'role': 'user', 'content': user_prompt}],
+                    options=self.ollama_options
                 )
-                return response['message']['content']
+                result = response['message']['content']
+            self._response_cache[key] = result
+            return result
         except Exception as e:
-            print(f"Error generating text: {e}")
-            return "Sorry, there was an error generating a response."
+            logger.error(f"Error generating text: {e}")
+            return GENERATION_ERROR
+
+    def _get_async_llm(self):
+        """Ollama AsyncClient bound to the running event loop.
+
+        httpx pools keep-alive connections on the loop that created them, so
+        one client shared across successive asyncio.run() loops would hand out
+        connections whose loop is already closed ("Event loop is closed").
+        Each loop gets its own client instead; the WeakKeyDictionary lets a
+        client go away with its loop.
+        """
+        loop = asyncio.get_running_loop()
+        client = self._loop_async_clients.get(loop)
+        if client is None:
+            client = ollama.AsyncClient(host=self.ollama_host, **_ollama_http_kwargs())
+            self._loop_async_clients[loop] = client
+        return client
+
+    async def agenerate_text(self, user_prompt: str) -> str:
+        """Async variant of generate_text; lets callers overlap several requests."""
+        if self.production_env:
+            response = await self.llm.generate_content_async(user_prompt)
+            return response.text
+        else:
+            response = await self._get_async_llm().chat(
+                model=self.current_model,
+                messages=[{'role': 'user', 'content': user_prompt}],
+                options=self.ollama_options
+            )
+            return response['message']['content']
+
+    def generate_text_stream(self, user_prompt: str):
+        """Yield response tokens as they arrive instead of buffering the full reply."""
+        try:
+            if self.production_env:
+                response = self.llm.generate_content(user_prompt, stream=True)
+                for chunk in response:
+                    yield chunk.text
+            else:
+                for chunk in self.llm.chat(
+                    model=self.current_model,
+                    messages=[{'role': 'user', 'content': user_prompt}],
+                    options=self.ollama_options,
+                    stream=True
+                ):
+                    yield chunk['message']['content']
+        except Exception as e:
+            logger.error(f"Error streaming text: {e}")
+            yield GENERATION_ERROR
+
+    def generate_text_batch(self, user_prompts: list[str], max_concurrent: int = None) -> list[str]:
+        """Generate responses for several prompts concurrently with asyncio.gather.
+
+        max_concurrent caps how many requests are in flight at once; None
+        leaves the fan-out unbounded.
+        """
+        logger.info(f"Generating {len(user_prompts)} responses concurrently.")
+        async def _gather():
+            semaphore = None if max_concurrent is None else asyncio.Semaphore(max_concurrent)
+            async def _one(prompt):
+                # Failures are isolated per prompt: one timeout or HTTP error
+                # yields its own sentinel instead of cancelling the siblings.
+                try:
+                    if semaphore is None:
+                        return await self.agenerate_text(prompt)
+                    async with semaphore:
+                        return await self.agenerate_text(prompt)
+                except Exception as e:
+                    logger.error(f"Error generating batch response: {e}")
+                    return GENERATION_ERROR
+            return await asyncio.gather(*(_one(p) for p in user_prompts))
+        try:
+            return asyncio.run(_gather())
+        except Exception as e:
+            logger.error(f"Error generating batch responses: {e}")
+            return [GENERATION_ERROR] * len(user_prompts)
 
     def _initialize_prompt(self):
         """Defines the chat prompt template."""
@@ -101,23 +360,37 @@ class AIAgent:
 
     def _get_session_history(self, session_id: str):
         """Returns the appropriate ChatMessageHistory for the session."""
-        logger.debug(f"Getting session history for session_id: {session_id}")
-        if config.config.LLM_PROVIDER == "ollama":
-            import os
-            os.makedirs(os.path.dirname(config.config.MEMORY_DB_PATH), exist_ok=True)
-            from langchain_community.chat_message_histories import ChatMessageHistory
-            return ChatMessageHistory()
-        elif config.config.LLM_PROVIDER == "gemini":
+        logger.debug("Getting session history for session_id: %s", session_id)
+        history = self._session_histories.get(session_id)
+        if history is None:
+            history = self._make_history(session_id)
+            window = getattr(config.config, "HISTORY_WINDOW", 0)
+            if window:
+                history = _WindowedChatHistory(history, self, window)
+            self._session_histories[session_id] = history
+        if not self._recent_histories or self._recent_histories[-1] is not history:
+            self._recent_histories.append(history)
+        return history
+
+    def _make_history(self, session_id: str):
+        """Creates a new history object for a session (called once per session_id)."""
+        if config.config.LLM_PROVIDER == "gemini":
             if not config.config.MEMORY_DB_URL:
                 logger.warning("MEMORY_DB_URL not set for production. Using in-memory history.")
-                from langchain_community.chat_message_histories import ChatMessageHistory
                 return ChatMessageHistory()
-            else:
-                from langchain_community.chat_message_histories import SQLChatMessageHistory
-                return SQLChatMessageHistory(
-                    session_id=session_id,
-                    connection_string=config.config.MEMORY_DB_URL
-                )
+            return SQLChatMessageHistory(
+                session_id=session_id,
+                connection_string=config.config.MEMORY_DB_URL
+            )
+        if _BatchedSQLChatMessageHistory is not None:
+            # Persistent dev history in WAL-mode SQLite; survives restarts and
+            # keeps per-turn writes sub-millisecond.
+            return _BatchedSQLChatMessageHistory(
+                session_id=session_id,
+                connection=_history_engine(config.config.MEMORY_DB_PATH)
+            )
+        logger.warning("SQLAlchemy not available. Using in-memory history.")
+        return ChatMessageHistory()
 
     def _initialize_message_history(self):
         """Wraps the chain with message history management."""
@@ -131,27 +404,58 @@ class AIAgent:
 
     def invoke(self, user_input: str, session_id: str):
         """Invokes the agent with user input and session ID."""
-        logger.info(f"Invoking agent for session {session_id} with input: {user_input[:80]}{'...' if len(user_input) > 80 else ''}")
+        logger.info("Invoking agent for session %s with input: %.80s", session_id, user_input)
         response = self.with_message_history.invoke(
             {"input": user_input},
             config={"configurable": {"session_id": session_id}}
         )
-        logger.debug(f"Agent response: {getattr(response, 'content', str(response))[:100]}")
+        logger.debug("Agent response: %.100s", getattr(response, 'content', response))
         return response.content
 
-if __name__ == "__main__":
-    agent = AIAgent()
+    async def ainvoke(self, user_input: str, session_id: str):
+        """Async variant of invoke; lets the REPL keep running while a call is in flight."""
+        logger.info("Invoking agent for session %s with input: %.80s", session_id, user_input)
+        response = await self.with_message_history.ainvoke(
+            {"input": user_input},
+            config={"configurable": {"session_id": session_id}}
+        )
+        return response.content
+
+    def warm(self):
+        """Preloads the Ollama model so the first real request skips the
+        weight-load stall. Uses the sync client so it can run on a background
+        thread without touching any event loop."""
+        if self.production_env:
+            return  # remote Gemini needs no warmup
+        try:
+            # An empty-prompt generate forces Ollama to load the model weights.
+            self.llm.generate(model=self.current_model, prompt="")
+            logger.debug("Ollama model preloaded.")
+        except Exception as e:
+            logger.debug("Model warmup failed (non-fatal): %s", e)
 
-    # Interactive chat session
+async def _chat_repl(agent):
+    """Interactive chat session; async so model warmup overlaps the first prompt."""
     dev_session_id = "user_abc_dev_session"
     print("Welcome to the AI chat! Type 'exit' to quit.")
+    warmup = asyncio.create_task(asyncio.to_thread(agent.warm))
+    session = PromptSession() if PromptSession is not None else None
     while True:
-        user_input = input("You: ")
+        if session is not None:
+            user_input = await session.prompt_async("You: ")
+        else:
+            user_input = await asyncio.to_thread(input, "You: ")
         if user_input.strip().lower() in {"exit", "quit"}:
             print("Goodbye!")
             break
-        response = agent.invoke(user_input, dev_session_id)
+        response = await agent.ainvoke(user_input, dev_session_id)
         print(f"AI: {response}")
+    if not warmup.done():
+        warmup.cancel()
+
+if __name__ == "__main__":
+    agent = AIAgent()
+    asyncio.run(_chat_repl(agent))
 
     # Example of how you would simulate production locally (by changing .env or directly in shell)
     # Uncomment the following to test "production" locally (requires GOOGLE_API_KEY in .env)
@@ -8,10 +8,14 @@
 # For Gemini, include its model name (e.g., gemini-pro) and potentially a default API key placeholder.
 # Use os.getenv for environment variables.
 
+import atexit
+import json
 import os
+import queue
 from dotenv import load_dotenv
 
 import logging
+from logging.handlers import QueueHandler, QueueListener
 
 load_dotenv() # Load environment variables from .env file
 
@@ -23,9 +27,15 @@ def get_logger():
     log_format = os.getenv("LOG_FORMAT", "%(asctime)s [%(levelname)s] %(name)s: %(message)s")
     logger = logging.getLogger("ai1")
     if not logger.hasHandlers():
-        handler = logging.StreamHandler()
-        handler.setFormatter(logging.Formatter(log_format))
-        logger.addHandler(handler)
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(log_format))
+        # Hot-path log calls only enqueue the record; a background listener
+        # thread does the actual stream I/O so logging never blocks a turn.
+        log_queue = queue.Queue(-1)
+        logger.addHandler(QueueHandler(log_queue))
+        listener = QueueListener(log_queue, stream_handler)
+        listener.start()
+        atexit.register(listener.stop)
     logger.setLevel(getattr(logging, log_level, logging.DEBUG))
     return logger
 
@@ -34,13 +44,35 @@ logger = get_logger()
 class Config:
     """Base configuration class."""
     APP_NAME = "MyAIAgent"
+    # Submit multi-question workloads as one concurrent batch instead of
+    # sequential calls (see summarizer.batch_answer_questions).
+    USE_BATCH_API = os.getenv("USE_BATCH_API", "true").lower() == "true"
+    # Number of recent messages replayed verbatim to the LLM; older turns are
+    # folded into a running summary. 0 disables trimming.
+    HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", "10"))
+    # Directory for a persistent LLM response cache (requires diskcache);
+    # empty means the cache lives in-process only.
+    RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", "")
+    # Ground QA on a one-shot long summary of the page instead of the full
+    # text: prefill tokens drop severalfold per question, at the cost of
+    # details the summary leaves out.
+    QA_USE_SUMMARY_CONTEXT = os.getenv("QA_USE_SUMMARY_CONTEXT", "false").lower() == "true"
     # Shared settings can go here
 
 class DevelopmentConfig(Config):
     """Development configuration using local Ollama."""
     LLM_PROVIDER = "ollama"
     OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://192.168.1.100:11434")
+    # Decode is memory-bandwidth-bound, so prefer a quantized model tag here
+    # (e.g. "gemma3:4b-it-q4_K_M"): halving weight bytes roughly doubles
+    # tokens/sec for the summarizer at small quality cost. Spot-check summary
+    # quality after switching tags.
     OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma3")
+    # Per-request generation options forwarded verbatim to Ollama as a JSON
+    # object, e.g. '{"num_ctx": 8192, "num_predict": 512}'. Decode-side
+    # accelerations like speculative/draft-model decoding are configured on
+    # the serving side; this knob covers the tuning the chat API exposes.
+    OLLAMA_OPTIONS = json.loads(os.getenv("OLLAMA_OPTIONS", "{}"))
     # Local memory persistence
     MEMORY_DB_PATH = "chat_histories/dev_memory.db"
 
@@ -1,4 +1,7 @@
 
+import functools
+import hashlib
+import logging
 import config
 logger = config.logger
 """
@@ -6,46 +9,71 @@ prompts.py
 Prompt generation utilities for LLM tasks: summarization and question answering.
 """
 
+# Instruction lookup tables, built once at import instead of per call.
+LENGTH_INSTRUCTIONS = {
+    'short': "Keep the summary concise, no more than 3-4 sentences.",
+    'medium': "Provide a moderately detailed summary, about 1-2 paragraphs.",
+    'long': "Provide a comprehensive summary, covering all key points in detail."
+}
+STYLE_INSTRUCTIONS = {
+    'executive_summary': "Format as an executive summary for a business audience.",
+    'bullet_points': "Format the summary as clear, concise bullet points.",
+    'narrative': "Write the summary in a narrative, story-like style."
+}
+
+# The builders are memoized: repeat calls with the same document (the three
+# summary styles, every QA turn) return the already-built prompt instead of
+# redoing O(len(document)) string work. str caches its hash, so the document
+# is only hashed once per object.
+@functools.lru_cache(maxsize=256)
 def get_summary_prompt(document_text: str, length: str, style: str) -> str:
-    logger.debug(f"Generating summary prompt (length={length}, style={style})")
     """
     Generate a detailed prompt for summarizing document_text.
     - length: 'short', 'medium', or 'long'
     - style: 'executive_summary', 'bullet_points', or 'narrative'
     """
-    length_instructions = {
-        'short': "Keep the summary concise, no more than 3-4 sentences.",
-        'medium': "Provide a moderately detailed summary, about 1-2 paragraphs.",
-        'long': "Provide a comprehensive summary, covering all key points in detail."
-    }
-    style_instructions = {
-        'executive_summary': "Format as an executive summary for a business audience.",
-        'bullet_points': "Format the summary as clear, concise bullet points.",
-        'narrative': "Write the summary in a narrative, story-like style."
-    }
-    length_text = length_instructions.get(length, "Provide a summary of appropriate length.")
-    style_text = style_instructions.get(style, "Format the summary in a clear and readable way.")
-    prompt = (
+    logger.debug("Generating summary prompt (length=%s, style=%s)", length, style)
+    length_text = LENGTH_INSTRUCTIONS.get(length, "Provide a summary of appropriate length.")
+    style_text = STYLE_INSTRUCTIONS.get(style, "Format the summary in a clear and readable way.")
+    # Single f-string so the (potentially large) document is copied once,
+    # instead of once per '+' concatenation.
+    return (
         f"You are an expert summarizer. Your task is to summarize the following document.\n"
         f"{length_text} {style_text}\n"
-        f"Document:\n" +
-        f"""{document_text}""" +
-        "\nSummary:"
+        f"Document:\n{document_text}\nSummary:"
     )
-    return prompt
 
-def get_qa_prompt(document_text: str, question: str) -> str:
-    logger.debug(f"Generating QA prompt for question: {question}")
+# Static QA instructions; part of the fixed prompt prefix below.
+QA_INSTRUCTIONS = (
+    "You are a helpful assistant. Answer the following question using only the information in the provided document. "
+    "If the answer is not present in the document, reply with 'The answer is not available in the provided document.'\n"
+)
+
+@functools.lru_cache(maxsize=32)
+def get_qa_prefix(document_text: str) -> str:
+    """
+    The instruction + document block shared by every question about one document.
+    Kept byte-identical across calls (deterministic whitespace, question only at
+    the tail of the final prompt) so inference servers with prefix caching can
+    reuse the document's KV cache instead of re-prefilling it per question.
+    """
+    prefix = f"{QA_INSTRUCTIONS}Document:\n{document_text}\n"
+    if logger.isEnabledFor(logging.DEBUG):
+        prefix_id = hashlib.blake2b(prefix.encode(), digest_size=8).hexdigest()
+        logger.debug("QA prompt prefix id %s (len=%d)", prefix_id, len(prefix))
+    return prefix
+
+@functools.lru_cache(maxsize=256)
+def get_qa_prompt(document_text: str, question: str, prefix: str = None) -> str:
     """
     Generate a prompt for answering a question strictly based on the provided document_text.
     The LLM must not use any outside knowledge or make up information.
+
+    Callers asking many questions about one document can compute the prefix
+    once with get_qa_prefix and pass it in, so the instruction + document
+    block is assembled once per document instead of once per question.
     """
-    prompt = (
-        "You are a helpful assistant. Answer the following question using only the information in the provided document. "
-        "If the answer is not present in the document, reply with 'The answer is not available in the provided document.'\n"
-        "Document:\n"
-        f"""{document_text}""" +
-        "\nQuestion: " + question +
-        "\nAnswer:"
-    )
-    return prompt
+    logger.debug("Generating QA prompt for question: %.100s", question)
+    if prefix is None:
+        prefix = get_qa_prefix(document_text)
+    return f"{prefix}Question: {question}\nAnswer:"
@@ -4,39 +4,358 @@ Main application for document summarization and question answering using AIAgent
 """
 
 
-from agent import AIAgent
+from agent import AIAgent, GENERATION_ERROR
 import prompts
 import requests
 from bs4 import BeautifulSoup
 import urllib.parse
 import re
+import sys
+import asyncio
+import atexit
+import collections
+import threading
+import concurrent.futures
+import hashlib
 import config
 logger = config.logger
 
-def summarize_document(document_text: str, agent_instance: AIAgent, length: str = 'medium', style: str = 'narrative') -> str:
-    """Summarize a document using the LLM agent and a generated prompt."""
+# One keep-alive session for all page fetches; repeated fetches to the same
+# host reuse a warm connection instead of paying TCP/TLS setup per URL.
+_http_session = requests.Session()
+_http_adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=32)
+_http_session.mount("http://", _http_adapter)
+_http_session.mount("https://", _http_adapter)
+atexit.register(_http_session.close)
+
+# Optional semantic QA cache: needs sentence-transformers (which brings numpy).
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    np = None
+    SentenceTransformer = None
+
+try:
+    import aiohttp
+except ImportError:  # multi-URL ingest falls back to a thread pool
+    aiohttp = None
+
+# selectolax parses in C and is an order of magnitude faster than
+# BeautifulSoup's pure-Python html.parser; fall back to bs4 if unavailable.
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
+_STRIP_TAGS = frozenset({'script', 'style', 'header', 'footer', 'nav', 'aside', 'form', 'noscript'})
+_CONTENT_TAGS = ('p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li')
+_STRIP_SELECTOR = ','.join(_STRIP_TAGS)
+_CONTENT_SELECTOR = ','.join(_CONTENT_TAGS)
+_NL_RE = re.compile(r'\n+')
+
+# Hard cap on downloaded HTML per page so a huge (or hostile) URL cannot
+# balloon memory; pages are read in chunks and truncated past the cap.
+_MAX_FETCH_BYTES = 5_000_000
+_FETCH_CHUNK_SIZE = 65536
+
+def _stream_to_stdout(agent_instance: AIAgent, prompt: str) -> str:
+    """Print tokens to stdout as they arrive and return the accumulated text."""
+    parts = []
+    for token in agent_instance.generate_text_stream(prompt):
+        sys.stdout.write(token)
+        sys.stdout.flush()
+        parts.append(token)
+    sys.stdout.write("\n")
+    return "".join(parts)
+
+# Map-reduce chunk size: roughly 2k tokens using the ~4 chars/token heuristic.
+_CHUNK_CHAR_TARGET = 8000
+
+# Sentinel returned by the summarize functions on failure, mirroring the
+# agent's GENERATION_ERROR.
+_SUMMARY_ERROR = "[Error: Could not generate summary.]"
+
+def _split_document(document_text: str, target: int = _CHUNK_CHAR_TARGET) -> list[str]:
+    """Split a document into ~target-character chunks at paragraph boundaries."""
+    chunks = []
+    current = []
+    size = 0
+    for paragraph in document_text.split('\n'):
+        if current and size + len(paragraph) > target:
+            chunks.append('\n'.join(current))
+            current = []
+            size = 0
+        current.append(paragraph)
+        size += len(paragraph) + 1
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+def summarize_document(document_text: str, agent_instance: AIAgent, length: str = 'medium', style: str = 'narrative', stream: bool = False, map_reduce: bool = False) -> str:
+    """Summarize a document using the LLM agent and a generated prompt.
+
+    With stream=True, tokens are printed to stdout as they arrive so the
+    first output appears at time-to-first-token instead of after the full
+    generation; the complete summary is still returned.
+
+    With map_reduce=True, long documents are split into ~2k-token chunks
+    that are summarized concurrently (map), and the final summary is then
+    produced from the concatenated chunk summaries (reduce). This keeps
+    each call inside context limits and parallelizes across chunks.
+    """
     try:
-        logger.info(f"Generating summary... (length: {length}, style: {style})")
+        logger.debug("Generating summary... (length: %s, style: %s)", length, style)
+        if map_reduce and len(document_text) > _CHUNK_CHAR_TARGET:
+            chunks = _split_document(document_text)
+            logger.info(f"Map-reduce summary over {len(chunks)} chunks.")
+            chunk_prompts = [prompts.get_summary_prompt(c, 'short', 'narrative') for c in chunks]
+            chunk_summaries = agent_instance.generate_text_batch(chunk_prompts)
+            # The batch call reports per-chunk failure via sentinels; reducing
+            # over them would return a confident summary of apology strings.
+            if any(s == GENERATION_ERROR for s in chunk_summaries):
+                logger.error("Map-reduce summary failed: one or more chunk summaries errored.")
+                return _SUMMARY_ERROR
+            document_text = '\n'.join(chunk_summaries)
         prompt = prompts.get_summary_prompt(document_text, length, style)
-        summary = agent_instance.generate_text(prompt)
-        logger.debug(f"Summary generated: {summary[:200]}{'...' if len(summary) > 200 else ''}")
+        if stream:
+            summary = _stream_to_stdout(agent_instance, prompt)
+        else:
+            summary = agent_instance.generate_text(prompt)
+        logger.debug("Summary generated: %.200s", summary)
         return summary
     except Exception as e:
         logger.error(f"Error generating summary: {e}")
-        return "[Error: Could not generate summary.]"
+        return _SUMMARY_ERROR
 
-def answer_question_about_document(document_text: str, question: str, agent_instance: AIAgent) -> str:
-    """Answer a question about a document using the LLM agent and a grounded prompt."""
+def summarize_document_variants(document_text: str, agent_instance: AIAgent, specs: list[tuple[str, str]]) -> list[str]:
+    """Produce several summaries of one document in a single concurrent batch.
+
+    specs is a list of (length, style) pairs; one summary is returned per
+    spec, in order. Submitting the prompts together lets the server schedule
+    them in one batch and amortizes the shared document prefill, instead of
+    paying a full round-trip per variant.
+    """
     try:
-        logger.info(f"Answering question based on document: {question}")
-        prompt = prompts.get_qa_prompt(document_text, question)
-        answer = agent_instance.generate_text(prompt)
-        logger.debug(f"Answer generated: {answer[:200]}{'...' if len(answer) > 200 else ''}")
+        logger.info(f"Generating {len(specs)} summary variants in one batch.")
+        variant_prompts = [prompts.get_summary_prompt(document_text, length, style) for length, style in specs]
+        return agent_instance.generate_text_batch(variant_prompts)
+    except Exception as e:
+        logger.error(f"Error generating summary variants: {e}")
+        return [_SUMMARY_ERROR] * len(specs)
+
+def _length_bucket(document_text: str) -> int:
+    """~log2 length bin; documents in one bin have comparable prefill/decode time."""
+    return (len(document_text) // 128).bit_length()
+
+def summarize_documents(documents: list[str], agent_instance: AIAgent, length: str = 'medium', style: str = 'narrative', max_workers: int = 32, max_concurrent: int = None) -> list[str]:
+    """Summarize many documents concurrently, preserving input order.
+
+    The blocking LLM calls overlap at the network layer, letting the server's
+    batcher pack them. max_concurrent (defaults to max_workers) caps in-flight
+    requests to respect provider rate limits.
+
+    On the batch path, documents are grouped into length buckets and each
+    bucket is submitted as one batch: mixed-length batches make short
+    documents wait on the longest one's decode, so near-uniform buckets
+    avoid that head-of-line blocking.
+    """
+    if not documents:
+        return []
+    logger.info(f"Summarizing {len(documents)} documents concurrently.")
+    if config.config.USE_BATCH_API:
+        buckets = collections.defaultdict(list)
+        for index, document_text in enumerate(documents):
+            buckets[_length_bucket(document_text)].append(index)
+        results = [None] * len(documents)
+        for bucket_indices in buckets.values():
+            bucket_prompts = [prompts.get_summary_prompt(documents[i], length, style) for i in bucket_indices]
+            bucket_summaries = agent_instance.generate_text_batch(bucket_prompts, max_concurrent=max_concurrent or max_workers)
+            for index, summary in zip(bucket_indices, bucket_summaries):
+                results[index] = summary
+        return results
+
+    limiter = threading.BoundedSemaphore(max_concurrent or max_workers)
+
+    def _summarize_one(document_text: str) -> str:
+        with limiter:
+            return summarize_document(document_text, agent_instance, length, style)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # executor.map keeps results aligned with the input documents.
+        return list(executor.map(_summarize_one, documents))
+
+class _SemanticQACache:
+    """Per-document cache of (question, answer) pairs matched by meaning.
+
+    Questions are embedded with a small sentence-transformers model and
+    compared by cosine similarity, so a rephrased version of an already
+    answered question returns the cached answer instead of a full LLM call.
+    Inert (every lookup misses) when sentence-transformers is not installed.
+    """
+
+    SIMILARITY_THRESHOLD = 0.92
+
+    def __init__(self):
+        self._encoder = None
+        # doc_key -> (normalized embedding matrix, parallel list of answers)
+        self._entries = {}
+
+    @property
+    def enabled(self) -> bool:
+        return SentenceTransformer is not None
+
+    @staticmethod
+    def doc_key(document_text: str) -> bytes:
+        return hashlib.blake2b(document_text.encode(), digest_size=8).digest()
+
+    def _embed(self, question: str):
+        if self._encoder is None:
+            logger.info("Loading sentence-transformers encoder for semantic QA cache...")
+            self._encoder = SentenceTransformer('all-MiniLM-L6-v2')
+        return self._encoder.encode([question], normalize_embeddings=True)[0]
+
+    def get(self, doc_key: bytes, question: str):
+        entry = self._entries.get(doc_key)
+        if entry is None:
+            return None
+        matrix, answers = entry
+        scores = matrix @ self._embed(question)
+        best = int(scores.argmax())
+        if scores[best] >= self.SIMILARITY_THRESHOLD:
+            logger.debug("Semantic QA cache hit (similarity=%.3f).", float(scores[best]))
+            return answers[best]
+        return None
+
+    def put(self, doc_key: bytes, question: str, answer: str):
+        # Re-embedding the short question here is cheap next to the LLM call.
+        embedding = self._embed(question)
+        entry = self._entries.get(doc_key)
+        if entry is None:
+            self._entries[doc_key] = (embedding.reshape(1, -1), [answer])
+        else:
+            matrix, answers = entry
+            answers.append(answer)
+            self._entries[doc_key] = (np.vstack([matrix, embedding]), answers)
+
+_qa_cache = _SemanticQACache()
+
+def answer_question_about_document(document_text: str, question: str, agent_instance: AIAgent, stream: bool = False, doc_prefix: str = None) -> str:
+    """Answer a question about a document using the LLM agent and a grounded prompt.
+
+    doc_prefix, if given, is a precomputed prompts.get_qa_prefix(document_text)
+    reused across questions about the same document.
+    """
+    try:
+        doc_key = None
+        if _qa_cache.enabled:
+            doc_key = _SemanticQACache.doc_key(document_text)
+            cached = _qa_cache.get(doc_key, question)
+            if cached is not None:
+                if stream:
+                    sys.stdout.write(cached + "\n")
+                    sys.stdout.flush()
+                return cached
+        logger.debug("Answering question based on document: %.100s", question)
+        prompt = prompts.get_qa_prompt(document_text, question, prefix=doc_prefix)
+        if stream:
+            answer = _stream_to_stdout(agent_instance, prompt)
+        else:
+            answer = agent_instance.generate_text(prompt)
+        logger.debug("Answer generated: %.200s", answer)
+        # Never cache failures: a cached error would be replayed for every
+        # later rephrasing instead of retrying. endswith also catches a
+        # partially streamed answer that ended in the error sentinel.
+        if doc_key is not None and not answer.endswith(GENERATION_ERROR):
+            _qa_cache.put(doc_key, question, answer)
         return answer
     except Exception as e:
         logger.error(f"Error answering question: {e}")
+        if stream:
+            sys.stdout.write("[Error: Could not answer question.]\n")
+            sys.stdout.flush()
         return "[Error: Could not answer question.]"
 
+async def asummarize_document(document_text: str, agent_instance: AIAgent, length: str = 'medium', style: str = 'narrative', semaphore: asyncio.Semaphore = None) -> str:
+    """Async counterpart of summarize_document, for use under asyncio.gather.
+
+    Pass a shared asyncio.Semaphore to cap in-flight requests when fanning
+    out many calls against a rate-limited provider.
+    """
+    try:
+        logger.debug("Generating summary... (length: %s, style: %s)", length, style)
+        prompt = prompts.get_summary_prompt(document_text, length, style)
+        if semaphore is not None:
+            async with semaphore:
+                return await agent_instance.agenerate_text(prompt)
+        return await agent_instance.agenerate_text(prompt)
+    except Exception as e:
+        logger.error(f"Error generating summary: {e}")
+        return _SUMMARY_ERROR
+
+async def aanswer_question_about_document(document_text: str, question: str, agent_instance: AIAgent, semaphore: asyncio.Semaphore = None) -> str:
+    """Async counterpart of answer_question_about_document."""
+    try:
+        logger.debug("Answering question based on document: %.100s", question)
+        prompt = prompts.get_qa_prompt(document_text, question)
+        if semaphore is not None:
+            async with semaphore:
+                return await agent_instance.agenerate_text(prompt)
+        return await agent_instance.agenerate_text(prompt)
+    except Exception as e:
+        logger.error(f"Error answering question: {e}")
+        return "[Error: Could not answer question.]"
+
+# Greetings and acknowledgements that don't warrant an LLM round-trip.
+_NON_QUESTION_RE = re.compile(
+    r'^(hi|hello|hey|yo|thanks?|thank you|thx|ty|ok(ay)?|cool|nice|great|bye|goodbye)[\s.!?]*$',
+    re.IGNORECASE,
+)
+
+def short_circuit_question(question: str):
+    """Returns a canned local answer for non-substantive inputs ('hi', 'thanks',
+    '?'), or None when the question should go to the LLM."""
+    stripped = question.strip()
+    if len(stripped) < 3:
+        return "Please ask a full question about the document."
+    if _NON_QUESTION_RE.match(stripped):
+        return "Happy to help! Ask a question about the document and I'll answer from its text."
+    return None
+
+# Query-agnostic compressed documents, keyed by document hash; re-ingesting
+# the same page reuses the compression instead of re-summarizing.
+_compressed_docs: dict[bytes, str] = {}
+
+def get_compressed_context(document_text: str, agent_instance: AIAgent) -> str:
+    """Return a compressed (long narrative summary) form of a document to use
+    as QA grounding in place of the full text."""
+    key = hashlib.blake2b(document_text.encode(), digest_size=8).digest()
+    compressed = _compressed_docs.get(key)
+    if compressed is None:
+        logger.info("Compressing document for QA context...")
+        compressed = summarize_document(document_text, agent_instance, length='long', style='narrative')
+        # Failures come back as sentinels, not exceptions; caching one would
+        # pin every future question on this document to an error context.
+        # Ground this turn on the full text and retry compression next time.
+        if compressed == _SUMMARY_ERROR or compressed.endswith(GENERATION_ERROR):
+            logger.warning("Document compression failed; using full text as QA context.")
+            return document_text
+        _compressed_docs[key] = compressed
+    return compressed
+
+def batch_answer_questions(document_text: str, questions: list[str], agent_instance: AIAgent) -> list[str]:
+    """Answer several questions about a document in one batch, in question order."""
+    try:
+        logger.info(f"Answering batch of {len(questions)} questions about document.")
+        doc_prefix = prompts.get_qa_prefix(document_text)
+        qa_prompts = [prompts.get_qa_prompt(document_text, q, prefix=doc_prefix) for q in questions]
+        if config.config.USE_BATCH_API:
+            return agent_instance.generate_text_batch(qa_prompts)
+        return [agent_instance.generate_text(p) for p in qa_prompts]
+    except Exception as e:
+        logger.error(f"Error answering batch of questions: {e}")
+        return ["[Error: Could not answer question.]"] * len(questions)
+
 
 # Utility function to fetch and clean text from a URL
 def fetch_text_from_url(url: str) -> str:
@@ -46,33 +365,101 @@ def fetch_text_from_url(url: str) -> str:
     """
     logger.info(f"Fetching text from URL: {url}")
     try:
-        response = requests.get(url, timeout=15)
+        with _http_session.get(url, stream=True, timeout=15) as response:
+            if response.status_code != 200:
+                logger.warning(f"Failed to retrieve URL (status code {response.status_code}): {url}")
+                return ""
+            buf = bytearray()
+            for chunk in response.iter_content(_FETCH_CHUNK_SIZE):
+                buf.extend(chunk)
+                if len(buf) > _MAX_FETCH_BYTES:
+                    logger.warning(f"Response exceeded {_MAX_FETCH_BYTES} bytes, truncating: {url}")
+                    break
+            html = bytes(buf).decode(response.encoding or 'utf-8', errors='replace')
     except requests.exceptions.RequestException as e:
         logger.error(f"Network error fetching URL: {e}")
         return ""
-    if response.status_code != 200:
-        logger.warning(f"Failed to retrieve URL (status code {response.status_code}): {url}")
+    text = _extract_text(html)
+    logger.debug("Fetched text length: %d", len(text))
+    return text
+
+
+async def _fetch_html(session, url: str) -> str:
+    """Fetches one URL's body asynchronously, honoring the same byte cap."""
+    try:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=15)) as response:
+            if response.status != 200:
+                logger.warning(f"Failed to retrieve URL (status code {response.status}): {url}")
+                return ""
+            buf = bytearray()
+            async for chunk in response.content.iter_chunked(_FETCH_CHUNK_SIZE):
+                buf.extend(chunk)
+                if len(buf) > _MAX_FETCH_BYTES:
+                    logger.warning(f"Response exceeded {_MAX_FETCH_BYTES} bytes, truncating: {url}")
+                    break
+            return bytes(buf).decode(response.charset or 'utf-8', errors='replace')
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Network error fetching URL: {e}")
         return ""
-    soup = BeautifulSoup(response.text, 'html.parser')
-    # Remove script, style, and non-content elements
-    for tag in soup(['script', 'style', 'header', 'footer', 'nav', 'aside', 'form', 'noscript']):
-        tag.decompose()
-    # Extract text from common content tags
-    content_tags = soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li'])
-    if content_tags:
-        text = '\n'.join(tag.get_text(separator=' ', strip=True) for tag in content_tags)
+
+
+async def _fetch_all_html(urls: list[str]) -> list[str]:
+    async with aiohttp.ClientSession() as session:
+        return await asyncio.gather(*(_fetch_html(session, url) for url in urls))
+
+
+def fetch_texts_from_urls(urls: list[str]) -> list[str]:
+    """
+    Fetches and extracts text from several URLs concurrently.
+    Network I/O overlaps via aiohttp; the CPU-bound HTML parsing then runs
+    in a process pool. Returns one (possibly empty) text per URL, in order.
+    """
+    if not urls:
+        return []
+    logger.info(f"Fetching {len(urls)} URLs concurrently.")
+    if aiohttp is None:
+        logger.debug("aiohttp not installed; fetching URLs in a thread pool.")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(urls))) as executor:
+            return list(executor.map(fetch_text_from_url, urls))
+    htmls = asyncio.run(_fetch_all_html(urls))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
+        return list(executor.map(_extract_text, htmls))
+
+
+def _extract_text(html: str) -> str:
+    """Extracts the main readable text from an HTML document."""
+    if HTMLParser is not None:
+        tree = HTMLParser(html)
+        # Remove script, style, and non-content elements
+        for node in tree.css(_STRIP_SELECTOR):
+            node.decompose()
+        # Extract text from common content tags
+        nodes = tree.css(_CONTENT_SELECTOR)
+        if nodes:
+            text = '\n'.join(n.text(separator=' ', strip=True) for n in nodes)
+        else:
+            text = tree.body.text(separator='\n', strip=True) if tree.body else ''
     else:
-        text = soup.get_text(separator='\n', strip=True)
+        soup = BeautifulSoup(html, 'html.parser')
+        for tag in soup(_STRIP_TAGS):
+            tag.decompose()
+        content_tags = soup.find_all(_CONTENT_TAGS)
+        if content_tags:
+            text = '\n'.join(tag.get_text(separator=' ', strip=True) for tag in content_tags)
+        else:
+            text = soup.get_text(separator='\n', strip=True)
     # Clean up excessive newlines and whitespace
-    text = re.sub(r'\n+', '\n', text)
-    text = text.strip()
-    logger.debug(f"Fetched text length: {len(text)}")
-    return text
+    text = _NL_RE.sub('\n', text)
+    return text.strip()
 
 
 if __name__ == "__main__":
     logger.info("=== URL Document Summarizer & QA ===")
     agent = AIAgent()
+    # Warm the model in the background: weight loading overlaps with the user
+    # typing a URL, the fetch, and prompt construction, so the first summary
+    # request hits an already-loaded model.
+    threading.Thread(target=agent.warm, daemon=True).start()
 
     while True:
         url = input("Enter a URL to summarize (or 'quit' to exit): ").strip()
@@ -92,12 +479,54 @@ if __name__ == "__main__":
         summary = summarize_document(fetched_text, agent, length='medium', style='narrative')
         print("\n--- Summary ---\n")
         print(summary)
+        # Optionally ground QA on the compressed form of the page, cutting
+        # per-question prefill tokens severalfold.
+        qa_context = fetched_text
+        if config.config.QA_USE_SUMMARY_CONTEXT:
+            qa_context = get_compressed_context(fetched_text, agent)
+        # Build the instruction + document block once per document; every
+        # question reuses it instead of reassembling the prefix per turn.
+        doc_prefix = prompts.get_qa_prefix(qa_context)
         print("\nYou can now ask questions about this document.")
         print("Type 'exit' or 'quit' to return to URL prompt.\n")
         while True:
-            user_question = input("Enter your question (or 'exit' to quit): ")
-            if user_question.strip().lower() in {"exit", "quit"}:
+            # Multi-line intake: several pasted questions go through the batch
+            # path and complete in roughly one round-trip instead of N.
+            questions = []
+            exiting = False
+            while True:
+                if questions:
+                    line = input("> ")
+                else:
+                    line = input("Enter your question(s), one per line (blank line to submit, 'exit' to quit): ")
+                stripped = line.strip()
+                if stripped.lower() in {"exit", "quit"}:
+                    exiting = True
+                    break
+                if not stripped:
+                    break
+                questions.append(stripped)
+            if exiting:
                 logger.info("Returning to URL prompt.")
                 break
-            answer = answer_question_about_document(fetched_text, user_question, agent)
-            print(f"Answer: {answer}\n")
+            if not questions:
+                continue
+            if len(questions) == 1:
+                # Trivial inputs get a canned local answer, skipping the LLM.
+                canned = short_circuit_question(questions[0])
+                if canned is not None:
+                    print(f"Answer: {canned}\n")
+                    continue
+                # Stream the answer so output starts at time-to-first-token
+                # instead of after the full generation.
+                print("Answer: ", end="", flush=True)
+                answer_question_about_document(qa_context, questions[0], agent, stream=True, doc_prefix=doc_prefix)
+                print()
+            else:
+                canned = [short_circuit_question(q) for q in questions]
+                llm_questions = [q for q, c in zip(questions, canned) if c is None]
+                llm_answers = iter(batch_answer_questions(qa_context, llm_questions, agent) if llm_questions else ())
+                answers = [c if c is not None else next(llm_answers) for c in canned]
+                for question, answer in zip(questions, answers):
+                    print(f"\nQ: {question}\nA: {answer}")
+                print()